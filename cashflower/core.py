@@ -1,12 +1,11 @@
 import functools
 import time
-import multiprocessing
 import numpy as np
 import pandas as pd
 import psutil
 
 from .error import CashflowModelError
-from .utils import get_first_indexes, get_object_by_name, print_log, split_to_ranges, updt
+from .utils import get_cpu_count, get_first_indexes, get_object_by_name, print_log, split_to_ranges, updt
 
 
 def get_variable_type(v):
@@ -117,7 +116,7 @@ class Variable:
     def calculate(self):
         t_max = len(self.result)
         if self.calc_direction == 0:
-            self.result = np.array([*map(self.func, range(t_max))], dtype=np.float64)
+            self.result[:] = [*map(self.func, range(t_max))]
         elif self.calc_direction == 1:
             for t in range(t_max):
                 self.result[t] = self.func(t)
@@ -167,7 +166,19 @@ class ArrayVariable(Variable):
         return f"AV: {self.func.__name__}"
 
     def calculate(self):
-        self.result = np.array(self.func(), dtype=np.float64)
+        try:
+            value = np.asarray(self.func(), dtype=np.float64)
+            valid = value.shape == self.result.shape
+        except (TypeError, ValueError):
+            valid = False
+
+        # Scalars and iterables of other sizes would be broadcast or fail on assignment
+        if not valid:
+            msg = (f"\n\nArray variable '{self.name}' must return an iterable of numbers "
+                   f"of the size T_MAX_CALCULATION+1 ({len(self.result)}).")
+            raise CashflowModelError(msg)
+
+        self.result[:] = value
 
 
 class StochasticVariable(Variable):
@@ -210,7 +221,7 @@ class StochasticVariable(Variable):
                 raise CashflowModelError(f"\n\nIncorrect calculation direction '{self.calc_direction}'.")
 
     def average_result_stoch(self):
-        self.result = np.mean(self.result_stoch, axis=0)
+        np.mean(self.result_stoch, axis=0, out=self.result)
 
 
 class Runplan:
@@ -339,21 +350,53 @@ class ModelPointSet:
 class Model:
     """Actuarial cash flow model.
     Model combines model variables and model point sets."""
-    def __init__(self, variables, model_point_sets, settings):
+    def __init__(self, variables, model_point_sets, settings, individual_results=None):
         self.variables = variables
         self.model_point_sets = model_point_sets
         self.settings = settings
+        self.individual_results = individual_results  # array shared with the parent process (multiprocessing)
+        self.results = self.allocate_results()
+        self.calc_order_groups = self.get_calc_order_groups()
+        self.output_variables = self.get_output_variables()
+        self.output_indexes = [self.variables.index(v) for v in self.output_variables]
+
+    def allocate_results(self):
+        """Allocate one contiguous array for results of all variables (rows in the calculation order).
+        Each variable's result is a view of its row, so variables write to the array in place."""
+        results = np.empty((len(self.variables), self.settings["T_MAX_CALCULATION"]+1))
+        for variable, result in zip(self.variables, results):
+            variable.result = result
+        return results
+
+    def get_calc_order_groups(self):
+        """Group variables by calculation order, each group is either a single variable or a cycle."""
+        groups = {}
+        for v in self.variables:
+            groups.setdefault(v.calc_order, []).append(v)
+        return [groups[calc_order] for calc_order in sorted(groups)]
 
-    def run(self, part=None):
-        """Orchestrate all steps of the cash flow model run."""
-        one_core = part == 0 or part is None  # single or first part
+    def get_output_variables(self):
+        """Get variables that are part of the output (in the order of the output columns)."""
+        if len(self.settings["OUTPUT_COLUMNS"]) == 0:
+            return self.variables
+        return [get_object_by_name(self.variables, name) for name in self.settings["OUTPUT_COLUMNS"]]
+
+    def run(self, part=None, num_parts=None):
+        """Orchestrate all steps of the cash flow model run.
+        With multiprocessing, model points are split into 'num_parts' ranges and only the range of 'part' is calculated.
+        """
+        one_core = part is None  # with multiprocessing, the main process shows logs and the progressbar
         main = get_object_by_name(self.model_point_sets, "main")
 
+        # Variables are reused when a worker process runs multiple parts
+        for v in self.variables:
+            v.runtime = 0.0
+
         # Set calculation ranges
         range_start, range_end = 0, len(main)
         if self.settings["MULTIPROCESSING"]:
-            main_ranges = split_to_ranges(len(main), multiprocessing.cpu_count())
-            # Number of model points is lower than the number of CPUs, only calculate on the 1st core
+            main_ranges = split_to_ranges(len(main), min(num_parts, len(main)) or 1)
+            # Number of model points is lower than the number of parts, only calculate the first parts
             if part >= len(main_ranges):
                 return None
             range_start, range_end = main_ranges[part]
@@ -385,19 +428,16 @@ class Model:
         p = functools.partial(self.calculate_model_point, one_core=one_core, progressbar_max=range_end)
 
         # Multiplier that takes into account aggregation type
-        multiplier = np.array([1 if v.aggregation_type == "sum" else 0 for v in self.variables])
+        multiplier = np.array([1 if v.aggregation_type == "sum" else 0 for v in self.output_variables])
 
         # Prepare output columns
-        if len(self.settings["OUTPUT_COLUMNS"]) == 0:
-            output_columns = [v.name for v in self.variables]
-        else:
-            output_columns = self.settings["OUTPUT_COLUMNS"]
+        output_columns = [v.name for v in self.output_variables]
 
         # Calculate batch_size based on available memory
         t = self.settings["T_MAX_OUTPUT"] + 1
         v = len(output_columns)
         float_size = np.dtype(np.float64).itemsize
-        num_cores = 1 if not self.settings["MULTIPROCESSING"] else multiprocessing.cpu_count()
+        num_cores = 1 if not self.settings["MULTIPROCESSING"] else get_cpu_count()
         batch_size = int((psutil.virtual_memory().available * 0.95) // ((t * v) * float_size) // num_cores)
 
         # Initial calculation batch
@@ -435,8 +475,9 @@ class Model:
                 raise CashflowModelError(msg)
             unique_groups = main.data[group_by_column].unique()
 
-            # Indexes of the first element from each group
-            first_indexes = get_first_indexes(main.data[group_by_column])
+            # Mask of the first element from each group
+            is_first = np.zeros(len(main), dtype=bool)
+            is_first[get_first_indexes(main.data[group_by_column])] = True
 
             # Initiate empty results
             group_sums = {group: np.array([np.zeros(t) for _ in range(v)]) for group in unique_groups}
@@ -445,7 +486,7 @@ class Model:
             while batch_start < range_end:
                 lst = [*map(p, range(batch_start, batch_end))]  # list of mp_results
                 groups = main.data.iloc[batch_start:batch_end][group_by_column].tolist()
-                if_firsts = [i in first_indexes for i in range(batch_start, batch_end)]
+                if_firsts = is_first[batch_start:batch_end]
 
                 for mp_result, group, if_first in zip(lst, groups, if_firsts):
                     if if_first:
@@ -469,46 +510,58 @@ class Model:
     def compute_individual_results(self, range_start, range_end, one_core):
         p = functools.partial(self.calculate_model_point, one_core=one_core, progressbar_max=range_end)
 
-        # Allocate memory for results
-        t = self.settings["T_MAX_OUTPUT"] + 1
-        v = len(self.variables) if len(self.settings["OUTPUT_COLUMNS"]) == 0 else len(self.settings["OUTPUT_COLUMNS"])
-        mp = range_end - range_start
-        float_size = np.dtype(np.float64).itemsize
-        results_size = t * v * mp * float_size
-        results_size_mb = results_size / (1024 ** 2)
-        num_cores = 1 if not self.settings["MULTIPROCESSING"] else multiprocessing.cpu_count()
-
-        # Results may require a lot of memory
-        msg = (f"Failed to allocate memory for the output with {t} periods, {v} variables, and {mp} model points "
-               f"(~{results_size_mb:.0f}) MB. Terminating model execution.")
+        # Individual results are written directly to the memory shared with the parent process
+        if self.individual_results is not None:
+            results = self.individual_results[range_start:range_end]
+            for i, row in enumerate(range(range_start, range_end)):
+                results[i] = np.transpose(p(row))
+            return None
 
         # Results do not fit into total RAM memory
-        total_ram_memory = psutil.virtual_memory().total / num_cores
-        if results_size > total_ram_memory:
-            raise CashflowModelError(msg)
+        mp = range_end - range_start
+        num_cores = 1 if not self.settings["MULTIPROCESSING"] else get_cpu_count()
+        self.check_individual_results_memory(mp, num_cores)
 
-        # Allocate results to available RAM memory
+        # Allocate results to available RAM memory (one array for all model points, filled in place)
+        t = self.settings["T_MAX_OUTPUT"] + 1
+        v = len(self.output_variables)
         try:
-            results = [np.empty((v, t), dtype=float) for _ in range(mp)]
+            results = np.empty((mp, t, v), dtype=float)
         except MemoryError:
-            raise CashflowModelError(msg)
-        else:
-            results = [*map(p, range(range_start, range_end))]
+            raise self.get_individual_results_memory_error(mp)
 
-        # Prepare output columns
-        if len(self.settings["OUTPUT_COLUMNS"]) == 0:
-            output_columns = [v.name for v in self.variables]
-        else:
-            output_columns = self.settings["OUTPUT_COLUMNS"]
+        for i, row in enumerate(range(range_start, range_end)):
+            results[i] = np.transpose(p(row))
 
         # Prepare the 'output' data frame
         print_log("Preparing output...", show_time=True, visible=one_core)
-        total_data = [pd.DataFrame(np.transpose(arr)) for arr in results]
-        output = pd.concat(total_data)
-        output.columns = output_columns
+        output = self.get_individual_output(results)
 
         return output
 
+    def get_individual_results_memory_error(self, num_model_points):
+        """Error for individual results that do not fit into the memory."""
+        t = self.settings["T_MAX_OUTPUT"] + 1
+        v = len(self.output_variables)
+        results_size_mb = t * v * num_model_points * np.dtype(np.float64).itemsize / (1024 ** 2)
+        msg = (f"Failed to allocate memory for the output with {t} periods, {v} variables, "
+               f"and {num_model_points} model points (~{results_size_mb:.0f}) MB. Terminating model execution.")
+        return CashflowModelError(msg)
+
+    def check_individual_results_memory(self, num_model_points, num_cores=1):
+        """Raise an error if individual results of the model points exceed the RAM memory of one core."""
+        t = self.settings["T_MAX_OUTPUT"] + 1
+        v = len(self.output_variables)
+        results_size = t * v * num_model_points * np.dtype(np.float64).itemsize
+        if results_size > psutil.virtual_memory().total / num_cores:
+            raise self.get_individual_results_memory_error(num_model_points)
+
+    def get_individual_output(self, results):
+        """Create output data frame from an array of results with the shape (model points, periods, variables)."""
+        mp, t, v = results.shape
+        output_columns = [v.name for v in self.output_variables]
+        return pd.DataFrame(data=results.reshape(mp * t, v), index=np.tile(np.arange(t), mp), columns=output_columns)
+
     def calculate_model_point(self, row, one_core, progressbar_max):
         """Returns array of arrays:
         [[v1_t0, v1_t1, v1_t2, ... v1_tm],
@@ -516,6 +569,8 @@ class Model:
          ...
          [vn_t0, vn_t1, vn_t2, ... v2_tm]]"""
         main = get_object_by_name(self.model_point_sets, "main")
+        t_max_calculation = self.settings["T_MAX_CALCULATION"]
+        t_max_output = self.settings["T_MAX_OUTPUT"]
 
         # Set model point's id
         model_point_id = main.data.index[row]
@@ -523,11 +578,7 @@ class Model:
             model_point_set.id = model_point_id
 
         # Perform calculations
-        max_calc_order = self.variables[-1].calc_order
-        for calc_order in range(1, max_calc_order + 1):
-            # Either a single variable or a cycle
-            variables = [v for v in self.variables if v.calc_order == calc_order]
-
+        for variables in self.calc_order_groups:
             # Single variable
             if len(variables) == 1:
                 v = variables[0]
@@ -540,11 +591,11 @@ class Model:
                 first_variable = variables[0]
                 calc_direction = first_variable.calc_direction
                 if calc_direction in (0, 1):
-                    for t in range(self.settings["T_MAX_CALCULATION"] + 1):
+                    for t in range(t_max_calculation + 1):
                         for v in variables:
                             v.calculate_t(t)
                 else:
-                    for t in range(self.settings["T_MAX_CALCULATION"], -1, -1):
+                    for t in range(t_max_calculation, -1, -1):
                         for v in variables:
                             v.calculate_t(t)
                 end = time.time()
@@ -557,11 +608,8 @@ class Model:
             if isinstance(v, StochasticVariable):
                 v.average_result_stoch()
 
-        # Get results and trim for T_MAX_OUTPUT,results may contain subset of columns
-        if len(self.settings["OUTPUT_COLUMNS"]) > 0:
-            mp_results = np.array([v.result[:self.settings["T_MAX_OUTPUT"]+1] for v in self.variables if v.name in self.settings["OUTPUT_COLUMNS"]])
-        else:
-            mp_results = np.array([v.result[:self.settings["T_MAX_OUTPUT"]+1] for v in self.variables])
+        # Get results and trim for T_MAX_OUTPUT, results may contain subset of columns
+        mp_results = self.results[self.output_indexes, :t_max_output+1]
 
         # Update progressbar
         if one_core:
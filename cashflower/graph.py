@@ -1,38 +1,58 @@
 import ast
+import functools
 import inspect
-import networkx as nx
+import linecache
 
-from queue import Queue
+from collections import deque
 
 from .error import CashflowModelError
-from .utils import get_object_by_name
+
+
+# Calling t+... requires backward calculation [-1], calling t-... requires forward calculation [1]
+CALC_DIRECTION_BY_OPERATOR = {ast.Add: -1, ast.Sub: 1}
 
 
 def create_directed_graph(variables, calls):
-    """Create a directed graph based on a list of variables and a dictionary of calls."""
-    dg = nx.DiGraph()
+    """Create a directed graph based on a list of variables and a dictionary of calls.
+
+    The graph is a dictionary of successors (key = variable; value = variables that call it).
+    Its predecessors are given by the dictionary of calls. Nodes are in the order of their first appearance.
+    """
+    dg = {}
     for variable in variables:
-        dg.add_node(variable)
+        dg.setdefault(variable, [])
         for predecessor in calls[variable]:
-            dg.add_edge(predecessor, variable)
+            dg.setdefault(predecessor, []).append(variable)
     return dg
 
 
-def filter_variables_and_graph(output_columns, variables, dg):
+def filter_variables_and_graph(output_columns, variables, dg, calls):
     """Select only variables and nodes that are required by the user."""
-    needed_variables = set()
-    output_variables = [get_object_by_name(variables, name) for name in output_columns]
+    variables_by_name = {variable.name: variable for variable in variables}
+    unknown_columns = [name for name in output_columns if name not in variables_by_name]
+    if len(unknown_columns) > 0:
+        msg = (f"\nUnknown output columns: {unknown_columns}. "
+               f"\nPlease review the 'OUTPUT_COLUMNS' setting, it should contain only names of model variables.")
+        raise CashflowModelError(msg)
 
-    for output_variable in output_variables:
-        needed_variables.add(output_variable)
-        needed_variables.update(get_predecessors(output_variable, dg))
+    output_variables = [variables_by_name[name] for name in output_columns]
+    needed_variables = get_predecessors(output_variables, calls)
 
-    unneeded_variables = set(variables) - needed_variables
-    dg.remove_nodes_from(unneeded_variables)
-    variables = list(needed_variables)
+    dg = {node: [s for s in successors if s in needed_variables]
+          for node, successors in dg.items() if node in needed_variables}
+    variables = [variable for variable in variables if variable in needed_variables]
     return variables, dg
 
 
+def get_cycles(nodes, dg):
+    """Get cycles (strongly connected components with more than one node) among the given nodes of the graph.
+    networkx is imported only here, so models without cycles do not need to import it."""
+    import networkx as nx
+
+    subgraph = nx.DiGraph({node: [s for s in dg[node] if s in nodes] for node in nodes})
+    return [component for component in nx.strongly_connected_components(subgraph) if len(component) > 1]
+
+
 def get_calls(variable, variables, argument_t_only=False):
     """List variables called by the given variable.
 
@@ -44,24 +64,23 @@ def get_calls(variable, variables, argument_t_only=False):
     Debug: print("\n", ast.dump(node, indent=2))
     """
     call_names = []
-    variable_names = [variable.name for variable in variables]
-    node = ast.parse(inspect.getsource(variable.func))
-
-    for subnode in ast.walk(node):
-        # Variable calls other variable directly (e.g. projection_year(t))
-        if isinstance(subnode, ast.Call):
-            if isinstance(subnode.func, ast.Name):
-                if subnode.func.id in variable_names:
-                    raise_error_if_incorrect_argument(subnode, variable)
-                    # Add variable regardless of its argument
-                    if argument_t_only is False:
-                        call_names.append(subnode.func.id)
-                    # Add variable only if it calls "t"
-                    else:
-                        if isinstance(subnode.args[0], ast.Name):
-                            call_names.append(subnode.func.id)
-
-    calls = [get_object_by_name(variables, call_name) for call_name in call_names if call_name != variable.name]
+    variables_by_name = {v.name: v for v in variables}
+
+    # Variable calls other variable directly (e.g. projection_year(t))
+    for subnode in get_call_nodes(variable.func):
+        if subnode.func.id in variables_by_name:
+            raise_error_if_incorrect_argument(subnode, variable)
+            # Add variable regardless of its argument
+            if argument_t_only is False:
+                call_names.append(subnode.func.id)
+            # Add variable only if it calls "t"
+            else:
+                if isinstance(subnode.args[0], ast.Name):
+                    call_names.append(subnode.func.id)
+
+    # Variable can call the same variable many times (e.g. my_variable(t-1) + my_variable(t)), keep one edge
+    unique_call_names = dict.fromkeys(call_names)
+    calls = [variables_by_name[call_name] for call_name in unique_call_names if call_name != variable.name]
     return calls
 
 
@@ -69,26 +88,18 @@ def get_calc_direction(variables):
     """Set calculation direction to irrelevant [0] / forward [1] / backward [-1]"""
     # For non-cycle => single variable, for cycle => variables from the cycle
     variable_names = [variable.name for variable in variables]
+    variable_names_set = frozenset(variable_names)
 
     calc_directions = set()
     for variable in variables:
-        node = ast.parse(inspect.getsource(variable.func))
-        for subnode in ast.walk(node):
-            if isinstance(subnode, ast.Call):
-                if isinstance(subnode.func, ast.Name):  # not a method
-                    if subnode.func.id in variable_names:  # single variable or another variable in the cycle
-                        arg = subnode.args[0]
-                        if isinstance(arg, ast.BinOp):
-                            # Does it call t+... or t-...?
-                            check1 = isinstance(arg.left, ast.Name) and arg.left.id == "t"
-                            check2 = isinstance(arg.op, ast.Add)
-                            check3 = isinstance(arg.op, ast.Sub)
-
-                            if check1 and check2:
-                                calc_directions.add(-1)
-
-                            if check1 and check3:
-                                calc_directions.add(1)
+        for subnode in get_call_nodes(variable.func):
+            if subnode.func.id in variable_names_set:  # single variable or another variable in the cycle
+                arg = subnode.args[0]
+                # Does it call t+... or t-...?
+                if isinstance(arg, ast.BinOp) and isinstance(arg.left, ast.Name) and arg.left.id == "t":
+                    calc_direction = CALC_DIRECTION_BY_OPERATOR.get(type(arg.op))
+                    if calc_direction is not None:
+                        calc_directions.add(calc_direction)
 
     # One calculation direction
     if len(calc_directions) == 1:
@@ -103,24 +114,76 @@ def get_calc_direction(variables):
     return 0
 
 
-def get_predecessors(node, dg):
-    """Get list of predecessors and their predecessors and their..."""
-    queue = Queue()
-    visited = []
+@functools.lru_cache(maxsize=None)
+def parse_func(func):
+    """Parse the source code of the variable's function into an abstract syntax tree.
+
+    The tree is cached because the same function is analysed multiple times (calls, cycles, calculation direction).
+    The returned tree is shared, so it must not be modified.
+    """
+    return ast.parse(get_source(func))
 
-    queue.put(node)
-    visited.append(node)
 
-    while not queue.empty():
-        node = queue.get()
-        for child in dg.predecessors(node):
+def get_source(func):
+    """Get the source code of the function (equivalent of inspect.getsource with cached file reads).
+
+    Lines come from linecache, which reads each file once and re-reads it when it has been modified.
+    """
+    code = func.__code__
+    linecache.checkcache(code.co_filename)
+    lines = linecache.getlines(code.co_filename)
+    if not lines:
+        return inspect.getsource(func)
+    return "".join(inspect.getblock(lines[code.co_firstlineno-1:]))
+
+
+@functools.lru_cache(maxsize=None)
+def get_call_nodes(func):
+    """List calls of functions by their name (e.g. my_variable(t)) in the variable's function.
+
+    Only such calls can refer to other model variables, so the syntax tree is walked once per function
+    and the analyses iterate over the call nodes instead of the whole tree.
+    """
+    node = parse_func(func)
+    return tuple(subnode for subnode in ast.walk(node)
+                 if isinstance(subnode, ast.Call) and isinstance(subnode.func, ast.Name))
+
+
+def get_predecessors(nodes, calls):
+    """Get set of nodes and their predecessors and their predecessors and their... (one search for all nodes)"""
+    queue = deque(nodes)
+    visited = set(nodes)
+
+    while queue:
+        node = queue.popleft()
+        for child in calls[node]:
             if child not in visited:
-                queue.put(child)
-                visited.append(child)
+                queue.append(child)
+                visited.add(child)
 
     return visited
 
 
+def release_nodes(nodes, dg, in_degree, position):
+    """Mark nodes as processed and return successors that have no unprocessed predecessors left (Kahn's algorithm).
+
+    The graph is not modified, only the 'in_degree' dictionary of unprocessed nodes is updated.
+    The released nodes are returned in the order of the graph's nodes.
+    """
+    for node in nodes:
+        del in_degree[node]
+
+    released = []
+    for node in nodes:
+        for successor in dg[node]:
+            if successor in in_degree:
+                in_degree[successor] -= 1
+                if in_degree[successor] == 0:
+                    released.append(successor)
+
+    return sorted(released, key=position.get)
+
+
 def raise_error_if_incorrect_argument(subnode, variable):
     """Model variables call other variables.
     Called variables can have maximally two arguments (for time and stochastic scenario).
@@ -167,13 +230,3 @@ def raise_error_if_incorrect_argument(subnode, variable):
             if not isinstance(arg.value, int):
                 raise CashflowModelError(msg)
 
-
-def set_calc_direction(variables):
-    max_calc_order = variables[-1].calc_order
-    for calc_order in range(1, max_calc_order + 1):
-        # Multiple variables can have the same calc_order if they are part of the cycle
-        calc_order_variables = [v for v in variables if v.calc_order == calc_order]
-        calc_direction = get_calc_direction(calc_order_variables)
-        for variable in calc_order_variables:
-            variable.calc_direction = calc_direction
-    return variables
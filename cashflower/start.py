@@ -3,18 +3,27 @@ import datetime
 import functools
 import getpass
 import importlib
-import inspect
+import mmap
 import multiprocessing
-import networkx as nx
 import numpy as np
 import os
 import pandas as pd
 import shutil
+import sys
 
 from .core import ArrayVariable, Model, ModelPointSet, Runplan, StochasticVariable, Variable
 from .error import CashflowModelError
-from .graph import create_directed_graph, filter_variables_and_graph, get_calls, get_predecessors, set_calc_direction
-from .utils import get_git_commit_info, get_object_by_name, print_log, save_log_to_file
+from .graph import (create_directed_graph, filter_variables_and_graph, get_calc_direction, get_calls, get_cycles,
+                    release_nodes)
+from .utils import (get_cpu_count, get_git_commit_info, get_object_by_name, print_log, save_log_to_file,
+                    save_output_to_file, updt)
+
+
+# Model components of the multiprocessing worker (runplan, model point sets and variables)
+model_components = None
+
+# Individual results of all model points in the memory shared by forked workers
+individual_results = None
 
 
 def create_model(model):
@@ -42,9 +51,15 @@ def load_settings(settings=None):
     if settings is None:
         return initial_settings
 
+    # User settings must be known, otherwise a misspelled setting would silently fall back to its default value
+    unknown_settings = [key for key in settings if key not in initial_settings]
+    if len(unknown_settings) > 0:
+        msg = (f"\nUnknown settings: {unknown_settings}. "
+               f"\nPlease review 'settings.py'. Available settings are: {list(initial_settings)}.")
+        raise CashflowModelError(msg)
+
     # Update with the user settings
-    for key, value in settings.items():
-        initial_settings[key] = value
+    initial_settings = {**initial_settings, **settings}
 
     # Maximal output t can't exceed maximal calculation t
     if initial_settings["T_MAX_CALCULATION"] < initial_settings["T_MAX_OUTPUT"]:
@@ -108,32 +123,43 @@ def get_variables(model_members, settings):
             raise CashflowModelError(msg)
         variable.name = name
 
-        # Initiate empty results
-        variable.result = np.empty(settings["T_MAX_CALCULATION"]+1)
         if isinstance(variable, StochasticVariable):
             if settings["NUM_STOCHASTIC_SCENARIOS"] is None:
                 msg = (f"\n\nThe model contains stochastic variable ('{name}')."
                        f"\nPlease set the number of stochastic scenarios ('NUM_STOCHASTIC_SCENARIOS' in 'settings.py').")
                 raise CashflowModelError(msg)
 
-            variable.result_stoch = np.empty((settings["NUM_STOCHASTIC_SCENARIOS"], settings["T_MAX_CALCULATION"]+1))
-
         variables.append(variable)
+
+    # Initiate empty stochastic results (results of all variables are allocated by the model)
+    stochastic_variables = [v for v in variables if isinstance(v, StochasticVariable)]
+    if len(stochastic_variables) > 0:
+        shape = (len(stochastic_variables), settings["NUM_STOCHASTIC_SCENARIOS"], settings["T_MAX_CALCULATION"]+1)
+        results_stoch = np.empty(shape)
+        for variable, result_stoch in zip(stochastic_variables, results_stoch):
+            variable.result_stoch = result_stoch
+
     return variables
 
 
+def get_module_members(module):
+    """Get module members as (name, value) pairs sorted by name.
+    Same as inspect.getmembers() but reads the module's namespace without calling getattr() on each name."""
+    return sorted(vars(module).items(), key=lambda member: member[0])
+
+
 def prepare_model_input(settings, args):
     """Get input for the cash flow model."""
     input_module = importlib.import_module("input")
     model_module = importlib.import_module("model")
 
     # input.py contains runplan and model point sets
-    input_members = inspect.getmembers(input_module)
+    input_members = get_module_members(input_module)
     runplan = get_runplan(input_members, args)
     model_point_sets = get_model_point_sets(input_members, settings, args)
 
     # model.py contains model variables
-    model_members = inspect.getmembers(model_module)
+    model_members = get_module_members(model_module)
     variables = get_variables(model_members, settings)
 
     return runplan, model_point_sets, variables
@@ -151,24 +177,33 @@ def resolve_calculation_order(variables, output_columns):
 
     # [3] User has chosen output so remove unneeded variables
     if output_columns is not None:
-        variables, dg = filter_variables_and_graph(output_columns, variables, dg)
+        variables, dg = filter_variables_and_graph(output_columns, variables, dg, calls)
 
     # [4] Set calculation order of variables ('calc_order')
+    position = {node: i for i, node in enumerate(dg)}
+    in_degree = {node: len(calls[node]) for node in dg}
+    nodes_without_predecessors = [node for node, degree in in_degree.items() if degree == 0]
     calc_order = 0
-    while dg.nodes:
-        nodes_without_predecessors = [n for n in dg.nodes if len(list(dg.predecessors(n))) == 0]
-
+    ordered_variables = []  # variables are added in the calculation order
+    while in_degree:
         # [4a] There are variables without any predecessors
         if len(nodes_without_predecessors) > 0:
             for node in nodes_without_predecessors:
                 calc_order += 1
                 node.calc_order = calc_order
-            dg.remove_nodes_from(nodes_without_predecessors)
+                node.calc_direction = get_calc_direction([node])
+                ordered_variables.append(node)
+            nodes_without_predecessors = release_nodes(nodes_without_predecessors, dg, in_degree, position)
 
         # [4b] There is a cyclic relationship between variables
         else:
-            cycles = list(nx.simple_cycles(dg))
-            cycles_without_predecessors = [c for c in cycles if len(get_predecessors(c[0], dg)) == len(c)]
+            # Each strongly connected component is a cycle (or overlapping cycles) calculated together
+            components = get_cycles(in_degree, dg)
+            cycles_without_predecessors = [
+                sorted(c, key=position.get) for c in components
+                if all(predecessor in c for node in c for predecessor in calls[node] if predecessor in in_degree)
+            ]
+            cycles_without_predecessors.sort(key=lambda c: position[c[0]])
 
             for cycle in cycles_without_predecessors:
                 # [4b_1] Ensure that there are no ArrayVariables in cycles
@@ -188,51 +223,63 @@ def resolve_calculation_order(variables, output_columns):
                 dg_cycle = create_directed_graph(cycle, calls_t)
 
                 # Set 'cycle_order'
+                cycle_position = {node: i for i, node in enumerate(dg_cycle)}
+                cycle_in_degree = {node: len(calls_t[node]) for node in dg_cycle}
+                cycle_nodes_without_predecessors = [cn for cn, degree in cycle_in_degree.items() if degree == 0]
                 cycle_order = 0
-                while dg_cycle.nodes:
-                    cycle_nodes_without_predecessors = [cn for cn in dg_cycle.nodes if len(list(dg_cycle.predecessors(cn))) == 0]
+                while cycle_in_degree:
                     if len(cycle_nodes_without_predecessors) > 0:
                         for node in cycle_nodes_without_predecessors:
                             cycle_order += 1
                             node.cycle_order = cycle_order
-                        dg_cycle.remove_nodes_from(cycle_nodes_without_predecessors)
+                        cycle_nodes_without_predecessors = release_nodes(cycle_nodes_without_predecessors, dg_cycle,
+                                                                         cycle_in_degree, cycle_position)
                     else:
-                        cycle_variable_nodes = [node.name for node in dg_cycle.nodes]
+                        cycle_variable_nodes = [node.name for node in cycle_in_degree]
                         msg = (f"Circular relationship without time step difference is not allowed. "
                                f"Please review variables: {cycle_variable_nodes}."
                                f"\nIf circular relationship without time step difference is necessary in your project, "
                                f"please raise it on: github.com/acturtle/cashflower")
                         raise CashflowModelError(msg)
 
-                # [4b_3] All the variables from a cycle have the same 'calc_order' value
+                # [4b_3] All the variables from a cycle have the same 'calc_order' and 'calc_direction' values
                 calc_order += 1
+                calc_direction = get_calc_direction(cycle)
                 for node in cycle:
                     node.calc_order = calc_order
+                    node.calc_direction = calc_direction
                     node.cycle = True
-                dg.remove_nodes_from(cycle)
-
-    # [5] Sort variables for calculation order
-    variables = sorted(variables, key=lambda x: (x.calc_order, x.cycle_order, x.name))
+                ordered_variables.extend(sorted(cycle, key=lambda x: (x.cycle_order, x.name)))
+                nodes_without_predecessors += release_nodes(cycle, dg, in_degree, position)
+            nodes_without_predecessors.sort(key=position.get)
 
-    # [6] Set calculation direction of calculation ('calc_direction' attribute)
-    variables = set_calc_direction(variables)
+    return ordered_variables
 
-    return variables
 
-
-def start_single_core(settings, args):
-    """Create and run a cash flow model."""
-    # Prepare model components
-    print_log("Reading model components...", show_time=True)
+def prepare_model(settings, args, visible=True):
+    """Read model components and resolve the calculation order of variables."""
+    print_log("Reading model components...", show_time=True, visible=visible)
     runplan, model_point_sets, variables = prepare_model_input(settings, args)
     output_columns = None if len(settings["OUTPUT_COLUMNS"]) == 0 else settings["OUTPUT_COLUMNS"]
     variables = resolve_calculation_order(variables, output_columns)
 
     # Log runplan version and number of model points
     if runplan is not None:
-        print_log(f"Runplan version: {runplan.version}")
+        print_log(f"Runplan version: {runplan.version}", visible=visible)
     main = get_object_by_name(model_point_sets, "main")
-    print_log(f"Number of model points: {len(main)}")
+    print_log(f"Number of model points: {len(main)}", visible=visible)
+
+    if settings["MULTIPROCESSING"]:
+        cpu_count = get_cpu_count()
+        print_log(f"Multiprocessing on {cpu_count} cores", visible=visible)
+        print_log(f"Calculation of ca. {len(main) // cpu_count} model points per core", visible=visible)
+
+    return runplan, model_point_sets, variables
+
+
+def start_single_core(settings, args):
+    """Create and run a cash flow model."""
+    runplan, model_point_sets, variables = prepare_model(settings, args)
 
     # Run model on single core
     model = Model(variables, model_point_sets, settings)
@@ -240,28 +287,26 @@ def start_single_core(settings, args):
     return output, runtime
 
 
-def start_multiprocessing(part, settings, args):
+def init_multiprocessing(components, results=None):
+    """Store model components (and the shared results array) prepared by the parent process in the worker process."""
+    global model_components, individual_results
+    model_components = components
+    individual_results = results
+
+
+def start_multiprocessing(part, settings, args, num_parts):
     """Run subset of the model points using multiprocessing."""
-    cpu_count = multiprocessing.cpu_count()
+    global model_components
     one_core = part == 0
 
-    # Prepare model components
-    print_log("Reading model components...", show_time=True, visible=one_core)
-    runplan, model_point_sets, variables = prepare_model_input(settings, args)
-    output_columns = None if len(settings["OUTPUT_COLUMNS"]) == 0 else settings["OUTPUT_COLUMNS"]
-    variables = resolve_calculation_order(variables, output_columns)
-
-    # Log runplan version and number of model points
-    if runplan is not None:
-        print_log(f"Runplan version: {runplan.version}", visible=one_core)
-    main = get_object_by_name(model_point_sets, "main")
-    print_log(f"Number of model points: {len(main)}", visible=one_core)
-    print_log(f"Multiprocessing on {cpu_count} cores", visible=one_core)
-    print_log(f"Calculation of ca. {len(main) // cpu_count} model points per core", visible=one_core)
+    # Prepare model components (unless they have been inherited from the parent process)
+    if model_components is None:
+        model_components = prepare_model(settings, args, visible=one_core)
+    runplan, model_point_sets, variables = model_components
 
     # Run model on multiple cores
-    model = Model(variables, model_point_sets, settings)
-    model_run = model.run(part)
+    model = Model(variables, model_point_sets, settings, individual_results)
+    model_run = model.run(part, num_parts)
 
     if model_run is None:
         part_output, part_runtime = None, None
@@ -270,17 +315,41 @@ def start_multiprocessing(part, settings, args):
     return part_output, part_runtime
 
 
+def create_shared_results(model, num_model_points):
+    """Allocate an array for individual results in the anonymous shared memory.
+    Forked workers write the results of their model points to it, so outputs are not pickled back."""
+    shape = (num_model_points, model.settings["T_MAX_OUTPUT"] + 1, len(model.output_variables))
+    size = int(np.prod(shape))
+    buffer = mmap.mmap(-1, max(size * np.dtype(np.float64).itemsize, 1))
+    return np.frombuffer(buffer, dtype=np.float64, count=size).reshape(shape)
+
+
 def merge_part_outputs(part_outputs, settings):
     """Merge outputs from multiprocessing and save to files."""
-    # Nones are returned, when number of policies < number of cpus
+    # Nones are returned, when number of policies < number of parts
     part_outputs = [po for po in part_outputs if po is not None]
 
     # Merge or concatenate outputs into one
     if settings["AGGREGATE"]:
-        output = functools.reduce(lambda x, y: x.add(y, fill_value=0), part_outputs)
-        if settings["GROUP_BY_COLUMN"] is not None:
-            # group_by_column should not be added up
-            output[settings["GROUP_BY_COLUMN"]] = part_outputs[0][settings["GROUP_BY_COLUMN"]]
+        group_by_column = settings["GROUP_BY_COLUMN"]
+        first = part_outputs[0]
+        same_structure = all(po.index.equals(first.index) and po.columns.equals(first.columns) for po in part_outputs)
+
+        # group_by_column should not be added up
+        columns = [column for column in first.columns if column != group_by_column]
+
+        # Parts have the same rows and columns, so their values are added up in one operation
+        if same_structure:
+            values = np.add.reduce([po[columns].to_numpy() for po in part_outputs])
+            output = pd.DataFrame(data=values, index=first.index, columns=columns)
+            if group_by_column is not None:
+                output.insert(first.columns.get_loc(group_by_column), group_by_column, first[group_by_column])
+        # Otherwise, rows with the same index are added up in one group by operation
+        else:
+            grouped = pd.concat(part_outputs).groupby(level=0, sort=False)
+            output = grouped[columns].sum()
+            if group_by_column is not None:
+                output.insert(first.columns.get_loc(group_by_column), group_by_column, grouped[group_by_column].first())
     else:
         output = pd.concat(part_outputs)
 
@@ -288,9 +357,10 @@ def merge_part_outputs(part_outputs, settings):
 
 
 def merge_part_diagnostic(part_diagnostic):
-    # Nones are returned, when number of policies < number of cpus
+    # Nones are returned, when number of policies < number of parts
     part_diagnostic = [item for item in part_diagnostic if item is not None]
-    total_runtimes = sum([item["runtime"] for item in part_diagnostic])
+    # Parts have the same variables in the same order, so their runtimes are added up in one operation
+    total_runtimes = np.add.reduce([item["runtime"].to_numpy() for item in part_diagnostic])
     diagnostic = part_diagnostic[0]
     diagnostic["runtime"] = total_runtimes
     return diagnostic
@@ -340,14 +410,41 @@ def run(settings=None, path=None):
 
     # Run on multiple cores
     if settings["MULTIPROCESSING"]:
-        p = functools.partial(start_multiprocessing, settings=settings, args=args)
-        cpu_count = multiprocessing.cpu_count()
-        with multiprocessing.Pool(cpu_count) as pool:
-            parts = pool.map(p, range(cpu_count))
+        cpu_count = get_cpu_count()
+        # Model points are split into more parts than cores, so that cores which finish early take the next parts
+        num_parts = 4 * cpu_count
+        p = functools.partial(start_multiprocessing, settings=settings, args=args, num_parts=num_parts)
+
+        # Forked workers inherit the model prepared once in the parent process, others prepare it on their own
+        model, results = None, None
+        if "fork" in multiprocessing.get_all_start_methods() and sys.platform != "darwin":
+            components = prepare_model(settings, args)
+            runplan, model_point_sets, variables = components
+            if not settings["AGGREGATE"]:
+                model = Model(variables, model_point_sets, settings)
+                num_model_points = len(get_object_by_name(model_point_sets, "main"))
+                # Results of all model points are allocated at once, so they must fit into RAM memory
+                model.check_individual_results_memory(num_model_points)
+                results = create_shared_results(model, num_model_points)
+            pool = multiprocessing.get_context("fork").Pool(cpu_count, initializer=init_multiprocessing,
+                                                            initargs=(components, results))
+        else:
+            pool = multiprocessing.Pool(cpu_count)
+
+        print_log("Starting calculations...", show_time=True)
+        with pool:
+            parts = []
+            for part in pool.imap(p, range(num_parts)):
+                parts.append(part)
+                updt(num_parts, len(parts))
 
         # Merge model outputs
-        part_outputs = [p[0] for p in parts]
-        output = merge_part_outputs(part_outputs, settings)
+        print_log("Preparing output...", show_time=True)
+        if results is not None:
+            output = model.get_individual_output(results)
+        else:
+            part_outputs = [p[0] for p in parts]
+            output = merge_part_outputs(part_outputs, settings)
 
         # Merge runtimes
         if settings["SAVE_DIAGNOSTIC"]:
@@ -355,8 +452,8 @@ def run(settings=None, path=None):
             diagnostic = merge_part_diagnostic(part_diagnostic)
 
     # Add time column
-    values = [*range(settings["T_MAX_OUTPUT"]+1)] * int(output.shape[0] / (settings["T_MAX_OUTPUT"]+1))
-    output.insert(0, "t", values)
+    t = settings["T_MAX_OUTPUT"] + 1
+    output.insert(0, "t", np.tile(np.arange(t), output.shape[0] // t))
     print_log("Finished!", show_time=True)
     print_log("")
 
@@ -368,7 +465,7 @@ def run(settings=None, path=None):
         if settings["SAVE_OUTPUT"]:
             filepath = f"output/{timestamp}_output.csv"
             print_log(f"Saving output file: {filepath}", show_time=True)
-            output.to_csv(filepath, index=False)
+            save_output_to_file(output, filepath)
 
         if settings["SAVE_DIAGNOSTIC"]:
             filepath = f"output/{timestamp}_diagnostic.csv"
@@ -1,3 +1,6 @@
+import functools
+import os
+import shutil
 import subprocess
 import sys
 
@@ -5,6 +8,7 @@ from datetime import datetime
 
 
 log_messages = []
+progressbar_text = None
 
 
 def print_log(msg, show_time=False, visible=True):
@@ -25,6 +29,29 @@ def save_log_to_file(timestamp):
         log_messages.clear()
 
 
+def save_output_to_file(output, filepath):
+    """Save the output data frame to a csv file.
+    If pyarrow is installed, its multithreaded csv writer is used instead of pandas."""
+    try:
+        import pyarrow
+        import pyarrow.csv
+    except ImportError:
+        output.to_csv(filepath, index=False)
+        return
+
+    table = pyarrow.Table.from_pandas(output, preserve_index=False)
+    pyarrow.csv.write_csv(table, filepath)
+
+
+@functools.lru_cache()
+def get_cpu_count():
+    """Get the number of CPUs that the process may use.
+    Unlike multiprocessing.cpu_count(), it respects the CPU affinity (e.g. CPUs assigned to a container)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
 def split_to_ranges(n, num_ranges):
     """n = 20, num_ranges = 3 --> (0, 6), (6, 12), (12, 20)"""
     if n < num_ranges:
@@ -53,7 +80,10 @@ def get_object_by_name(objects, name):
 
 def updt(total, progress):
     """Display or update a console progress bar.
-    Original source: https://stackoverflow.com/a/15860757/1391441"""
+    Original source: https://stackoverflow.com/a/15860757/1391441
+
+    The console is written to only when the displayed text changes (it's called for each model point)."""
+    global progressbar_text
     bar_length, status = 20, ""
     progress = float(progress) / float(total)
     if progress >= 1.:
@@ -62,29 +92,40 @@ def updt(total, progress):
     text = "\r[{}] {:.0f}% {}".format(
         "#" * block + "-" * (bar_length - block), round(progress * 100, 0),
         status)
+    if text == progressbar_text:
+        return None
+    # Finished progress bar is not remembered, so the next one starts from scratch
+    progressbar_text = None if status else text
     sys.stdout.write(text)
     sys.stdout.flush()
 
 
+def run_git_command(*args):
+    """Run a git command (without a shell) and return its output."""
+    result = subprocess.run(["git", *args], capture_output=True, text=True, check=True, timeout=5)
+    return result.stdout.strip()
+
+
 def get_git_commit_info():
-    try:
-        # Check if the current directory is a Git repository
-        subprocess.check_output("git rev-parse --is-inside-work-tree", shell=True, stderr=subprocess.STDOUT, text=True)
+    # Git is not installed
+    if shutil.which("git") is None:
+        return None
 
-        # Get the Git commit hash
-        commit_hash = subprocess.check_output("git rev-parse HEAD", shell=True).decode("utf-8").strip()
+    try:
+        # Get the Git commit hash (fails if the current directory is not a Git repository)
+        commit_hash = run_git_command("rev-parse", "HEAD")
 
         # Check if there are local changes
-        status_output = subprocess.check_output("git status --porcelain", shell=True).decode("utf-8").strip()
-
-        if status_output:
-            return f"{commit_hash} (with local changes)"
-        else:
-            return f"{commit_hash}"
-    except subprocess.CalledProcessError:
-        # Not a Git repository
+        status_output = run_git_command("status", "--porcelain")
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError):
+        # Not a Git repository or git does not respond
         return None
 
+    if status_output:
+        return f"{commit_hash} (with local changes)"
+    else:
+        return f"{commit_hash}"
+
 
 def get_first_indexes(items):
     """Get the list of indexes for the first occurrence of the given item in the list.
@@ -4,8 +4,8 @@ import pytest
 
 from unittest import TestCase
 
-from cashflower.core import CashflowModelError, ModelPointSet, Runplan, variable, Variable
-from cashflower.start import load_settings
+from cashflower.core import CashflowModelError, Model, ModelPointSet, Runplan, variable, Variable
+from cashflower.start import create_shared_results, load_settings, merge_part_outputs
 
 
 class TestVariableDecorator(TestCase):
@@ -92,3 +92,133 @@ class TestVariable(TestCase):
 
         with pytest.raises(CashflowModelError):
             foo(721)
+
+
+class TestArrayVariable(TestCase):
+    def test_array_variable_writes_result_in_place(self):
+        @variable(array=True)
+        def foo():
+            return [t for t in range(721)]
+
+        foo.name = "foo"
+        result = np.empty(721)
+        foo.result = result
+
+        foo.calculate()
+
+        assert foo.result is result
+        assert foo(10) == 10
+
+    def test_array_variable_raises_error_when_incorrect_size(self):
+        @variable(array=True)
+        def foo():
+            return [t for t in range(10)]
+
+        foo.name = "foo"
+        foo.result = np.empty(721)
+
+        with pytest.raises(CashflowModelError):
+            foo.calculate()
+
+    def test_array_variable_raises_error_when_scalar(self):
+        @variable(array=True)
+        def foo():
+            return 5
+
+        @variable(array=True)
+        def bar():
+            return [5]
+
+        for name, v in [("foo", foo), ("bar", bar)]:
+            v.name = name
+            v.result = np.empty(721)
+            with pytest.raises(CashflowModelError):
+                v.calculate()
+
+    def test_array_variable_raises_error_when_not_numbers(self):
+        @variable(array=True)
+        def foo():
+            return ["a" for _ in range(721)]
+
+        foo.name = "foo"
+        foo.result = np.empty(721)
+
+        with pytest.raises(CashflowModelError):
+            foo.calculate()
+
+
+def create_test_model(settings, individual_results=None):
+    """Model with two model points and three variables (the second one aggregated with the 'first' type)."""
+    main = ModelPointSet(data=pd.DataFrame({"id": [1, 2], "age": [52, 47]}))
+    main.name = "main"
+    main.settings = settings
+    main.initialize()
+
+    @variable()
+    def foo(t):
+        return main.get("age") + t
+
+    @variable(aggregation_type="first")
+    def bar(t):
+        return main.get("age") * 100 + t
+
+    @variable()
+    def baz(t):
+        return foo(t) * 2
+
+    for calc_order, (name, v) in enumerate([("foo", foo), ("bar", bar), ("baz", baz)], start=1):
+        v.name = name
+        v.calc_order = calc_order
+        v.calc_direction = 0
+
+    return Model([foo, bar, baz], [main], settings, individual_results)
+
+
+class TestModel(TestCase):
+    def test_model_run_aggregated_with_output_columns(self):
+        settings = load_settings({"OUTPUT_COLUMNS": ["bar", "foo"], "T_MAX_CALCULATION": 2, "T_MAX_OUTPUT": 2})
+        output, diagnostic = create_test_model(settings).run()
+        assert output.equals(pd.DataFrame({"bar": [5200.0, 5201.0, 5202.0], "foo": [99.0, 101.0, 103.0]}))
+
+    def test_model_run_individual_with_output_columns(self):
+        settings = load_settings({"AGGREGATE": False, "OUTPUT_COLUMNS": ["bar", "foo"],
+                                  "T_MAX_CALCULATION": 2, "T_MAX_OUTPUT": 2})
+        output, diagnostic = create_test_model(settings).run()
+        assert list(output.columns) == ["bar", "foo"]
+        assert output["bar"].tolist() == [5200.0, 5201.0, 5202.0, 4700.0, 4701.0, 4702.0]
+        assert output["foo"].tolist() == [52.0, 53.0, 54.0, 47.0, 48.0, 49.0]
+
+    def test_model_run_parts_add_up_to_aggregated_output(self):
+        settings = load_settings({"T_MAX_CALCULATION": 2, "T_MAX_OUTPUT": 2})
+        expected, _ = create_test_model(settings).run()
+
+        # More parts than model points, the remaining parts are not calculated
+        settings = load_settings({"MULTIPROCESSING": True, "T_MAX_CALCULATION": 2, "T_MAX_OUTPUT": 2})
+        model = create_test_model(settings)
+        model_runs = [model.run(part, num_parts=5) for part in range(5)]
+        assert [model_run is None for model_run in model_runs] == [False, False, True, True, True]
+        part_outputs = [model_run[0] for model_run in model_runs if model_run is not None]
+
+        output = merge_part_outputs(part_outputs, settings)
+        pd.testing.assert_frame_equal(output, expected)
+        assert output["bar"].tolist() == [5200.0, 5201.0, 5202.0]
+
+    def test_model_run_writes_individual_results_to_shared_memory(self):
+        settings = load_settings({"AGGREGATE": False, "T_MAX_CALCULATION": 2, "T_MAX_OUTPUT": 2})
+        expected, _ = create_test_model(settings).run()
+
+        settings = load_settings({"AGGREGATE": False, "MULTIPROCESSING": True, "T_MAX_CALCULATION": 2, "T_MAX_OUTPUT": 2})
+        results = create_shared_results(create_test_model(settings), num_model_points=2)
+        model = create_test_model(settings, individual_results=results)
+        model_runs = [model.run(part, num_parts=3) for part in range(3)]
+        # Workers return no output, their results are written to the shared array
+        assert all(model_run is None or model_run[0] is None for model_run in model_runs)
+
+        pd.testing.assert_frame_equal(model.get_individual_output(results), expected)
+
+    def test_model_raises_error_when_individual_results_exceed_memory(self):
+        settings = load_settings({"AGGREGATE": False, "T_MAX_CALCULATION": 2, "T_MAX_OUTPUT": 2})
+        model = create_test_model(settings)
+        model.check_individual_results_memory(num_model_points=2)
+        with pytest.raises(CashflowModelError):
+            model.check_individual_results_memory(num_model_points=10**15)
@@ -0,0 +1,55 @@
+import importlib
+import os
+import pytest
+import sys
+import tempfile
+
+from unittest import TestCase
+
+from cashflower.core import variable
+from cashflower.error import CashflowModelError
+from cashflower.graph import create_directed_graph, filter_variables_and_graph, get_calls, get_source
+
+
+class TestGetSource(TestCase):
+    def test_get_source_after_module_is_modified(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, "graph_test_model.py")
+            with open(filepath, "w") as file:
+                file.write("from cashflower import variable\n\n\n"
+                           "@variable()\ndef a(t):\n    return 1\n\n\n"
+                           "@variable()\ndef b(t):\n    return 2\n")
+
+            sys.path.insert(0, tmp_dir)
+            try:
+                model = importlib.import_module("graph_test_model")
+                model.a.name, model.b.name = "a", "b"
+                assert get_calls(model.b, [model.a, model.b]) == []
+
+                # The function is moved and calls another variable
+                with open(filepath, "w") as file:
+                    file.write("from cashflower import variable\n\n\n"
+                               "@variable()\ndef a(t):\n    return 1\n\n\n\n\n"
+                               "@variable()\ndef b(t):\n    return a(t) + 2\n")
+                model = importlib.reload(model)
+                model.a.name, model.b.name = "a", "b"
+
+                assert "return a(t) + 2" in get_source(model.b.func)
+                assert get_calls(model.b, [model.a, model.b]) == [model.a]
+            finally:
+                sys.path.remove(tmp_dir)
+                sys.modules.pop("graph_test_model", None)
+
+
+class TestFilterVariablesAndGraph(TestCase):
+    def test_filter_variables_and_graph_raises_error_when_unknown_output_column(self):
+        @variable()
+        def a(t):
+            return 1
+
+        a.name = "a"
+        calls = {a: []}
+        dg = create_directed_graph([a], calls)
+        assert filter_variables_and_graph(["a"], [a], dg, calls) == ([a], {a: []})
+        with pytest.raises(CashflowModelError):
+            filter_variables_and_graph(["a", "b"], [a], dg, calls)
@@ -7,6 +7,27 @@ from cashflower.core import *
 from cashflower.start import *
 
 
+# Overlapping cycles (cycle_a <-> cycle_b and cycle_b <-> cycle_c) for TestResolveCalculationOrder
+@variable()
+def cycle_a(t):
+    return 1 if t == 0 else cycle_b(t-1) + 1
+
+
+@variable()
+def cycle_b(t):
+    return cycle_a(t) + (0 if t == 0 else cycle_c(t-1))
+
+
+@variable()
+def cycle_c(t):
+    return cycle_b(t) * 0.5
+
+
+@variable()
+def after_cycle(t):
+    return cycle_c(t) + cycle_a(t)
+
+
 class TestCreateModel(TestCase):
     def test_create_model(self):
         create_model("annuity")
@@ -58,6 +79,27 @@ class TestLoadSettings(TestCase):
             "T_MAX_OUTPUT": 100,
         }
 
+    def test_load_settings_raises_error_when_unknown_setting(self):
+        with pytest.raises(CashflowModelError):
+            load_settings({"T_MAX_CALCULTION": 100})
+
+
+class TestResolveCalculationOrder(TestCase):
+    def test_resolve_calculation_order_with_overlapping_cycles(self):
+        variables = [cycle_a, cycle_b, cycle_c, after_cycle]
+        for name, v in zip(["cycle_a", "cycle_b", "cycle_c", "after_cycle"], variables):
+            v.name = name
+
+        variables = resolve_calculation_order(variables, None)
+
+        assert variables == [cycle_a, cycle_b, cycle_c, after_cycle]
+        # Overlapping cycles are calculated together
+        assert [v.calc_order for v in variables] == [1, 1, 1, 2]
+        assert [v.cycle for v in variables] == [True, True, True, False]
+        # Within the cycle, variables called with "t" are calculated first
+        assert [v.cycle_order for v in variables[:3]] == [1, 2, 3]
+        assert [v.calc_direction for v in variables[:3]] == [1, 1, 1]
+
 
 class TestGetRunplan(TestCase):
     def test_get_runplan(self):
@@ -101,3 +143,44 @@ class TestGetVariables(TestCase):
         model_members = [("foo", "foo"), ("t", t)]
         with pytest.raises(CashflowModelError):
             get_variables(model_members, settings)
+
+
+class TestMergePartOutputs(TestCase):
+    def test_merge_part_outputs(self):
+        settings = load_settings()
+        part_outputs = [
+            pd.DataFrame({"a": [1.0, 2.0], "b": [3.0, 4.0]}),
+            None,
+            pd.DataFrame({"a": [10.0, 20.0], "b": [30.0, 40.0]}),
+        ]
+        output = merge_part_outputs(part_outputs, settings)
+        assert output.equals(pd.DataFrame({"a": [11.0, 22.0], "b": [33.0, 44.0]}))
+
+    def test_merge_part_outputs_with_group_by_column(self):
+        settings = load_settings({"GROUP_BY_COLUMN": "group"})
+        part_outputs = [
+            pd.DataFrame({"group": ["A", "B"], "a": [1.0, 2.0]}),
+            pd.DataFrame({"group": ["A", "B"], "a": [10.0, 20.0]}),
+        ]
+        output = merge_part_outputs(part_outputs, settings)
+        assert output.equals(pd.DataFrame({"group": ["A", "B"], "a": [11.0, 22.0]}))
+
+    def test_merge_part_outputs_with_different_rows(self):
+        settings = load_settings({"GROUP_BY_COLUMN": "group"})
+        part_outputs = [
+            pd.DataFrame({"group": ["A", "B"], "a": [1.0, 2.0]}, index=[0, 1]),
+            pd.DataFrame({"group": ["B", "C"], "a": [20.0, 30.0]}, index=[1, 2]),
+        ]
+        output = merge_part_outputs(part_outputs, settings)
+        assert output.equals(pd.DataFrame({"group": ["A", "B", "C"], "a": [1.0, 22.0, 30.0]}, index=[0, 1, 2]))
+
+
+class TestMergePartDiagnostic(TestCase):
+    def test_merge_part_diagnostic(self):
+        part_diagnostic = [
+            pd.DataFrame({"variable": ["a", "b"], "runtime": [1.0, 2.0]}),
+            None,
+            pd.DataFrame({"variable": ["a", "b"], "runtime": [0.5, 0.25]}),
+        ]
+        diagnostic = merge_part_diagnostic(part_diagnostic)
+        assert diagnostic.equals(pd.DataFrame({"variable": ["a", "b"], "runtime": [1.5, 2.25]}))
@@ -1,6 +1,12 @@
+import os
+import pandas as pd
+import pytest
+import tempfile
+
 from unittest import TestCase
 
-from cashflower.utils import get_first_indexes, get_object_by_name, print_log, split_to_ranges, updt
+from cashflower.utils import (get_cpu_count, get_first_indexes, get_object_by_name, print_log, save_output_to_file,
+                              split_to_ranges, updt)
 
 
 class TestSplitToRanges(TestCase):
@@ -9,6 +15,11 @@ class TestSplitToRanges(TestCase):
         assert split_to_ranges(2, 3) == [(0, 2)]
 
 
+class TestGetCpuCount(TestCase):
+    def test_get_cpu_count(self):
+        assert 1 <= get_cpu_count() <= os.cpu_count()
+
+
 class TestGetObjectByName(TestCase):
     def test_get_object_by_name(self):
         class Object:
@@ -33,3 +44,25 @@ class TestPrintFunctions(TestCase):
 class TestGetFirstIndexes(TestCase):
     def test_get_first_indexes(self):
         assert get_first_indexes(["A", "A", "B", "A", "C", "D"]) == [0, 2, 4, 5]
+
+
+class TestSaveOutputToFile(TestCase):
+    def test_save_output_to_file(self):
+        output = pd.DataFrame({"t": [0, 1, 2], "a": [1.0, 0.1, 1/3], "group": ["A", "B,C", "D"]})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, "output.csv")
+            save_output_to_file(output, filepath)
+            assert pd.read_csv(filepath).equals(output)
+
+    def test_save_output_to_file_with_pyarrow(self):
+        pytest.importorskip("pyarrow")
+        output = pd.DataFrame({"t": [0, 1, 2], "a": [1.0, 0.1, 1/3], "group": ["A", "B,C", "D"]})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, "output.csv")
+            save_output_to_file(output, filepath)
+            with open(filepath) as file:
+                lines = file.read().splitlines()
+            # pyarrow quotes the header and strings and writes whole floats without decimals
+            assert lines[0] == '"t","a","group"'
+            assert lines[1] == '0,1,"A"'
+            assert pd.read_csv(filepath).equals(output)
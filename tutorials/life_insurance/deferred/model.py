@@ -1,4 +1,6 @@
-from cashflower import variable
+import numpy as np
+
+from cashflower import discount, variable
 
 from input import main
 from settings import settings
@@ -7,11 +9,9 @@ INTEREST_RATE = 0.005
 DEATH_PROB = 0.003
 
 
-@variable()
-def survival_rate(t):
-    if t == 0:
-        return 1 - DEATH_PROB
-    return survival_rate(t-1) * (1 - DEATH_PROB)
+@variable(array=True)
+def survival_rate():
+    return np.cumprod(np.full(settings["T_MAX_CALCULATION"]+1, 1 - DEATH_PROB))
 
 
 @variable()
@@ -21,8 +21,7 @@ def expected_benefit(t):
     return survival_rate(t-1) * DEATH_PROB * main.get("sum_assured")
 
 
-@variable()
-def net_single_premium(t):
-    if t == settings["T_MAX_CALCULATION"]:
-        return expected_benefit(t)
-    return expected_benefit(t) + net_single_premium(t+1) * 1/(1+INTEREST_RATE)
+@variable(array=True)
+def net_single_premium():
+    discount_rates = np.full(settings["T_MAX_CALCULATION"]+1, 1/(1+INTEREST_RATE))
+    return discount(expected_benefit(), discount_rates)
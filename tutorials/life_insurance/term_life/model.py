@@ -1,4 +1,6 @@
-from cashflower import variable
+import numpy as np
+
+from cashflower import discount, variable
 
 from input import main
 from settings import settings
@@ -7,24 +9,20 @@ INTEREST_RATE = 0.005
 DEATH_PROB = 0.003
 
 
-@variable()
-def survival_rate(t):
-    if t == 0:
-        return 1 - DEATH_PROB
-    return survival_rate(t-1) * (1 - DEATH_PROB)
+@variable(array=True)
+def survival_rate():
+    return np.cumprod(np.full(settings["T_MAX_CALCULATION"]+1, 1 - DEATH_PROB))
 
 
-@variable()
-def expected_benefit(t):
-    if t == 0:
-        return 0
-    if t > main.get("remaining_term"):
-        return 0
-    return survival_rate(t-1) * DEATH_PROB * main.get("sum_assured")
+@variable(array=True)
+def expected_benefit():
+    periods = np.arange(settings["T_MAX_CALCULATION"]+1)
+    benefit = np.zeros(settings["T_MAX_CALCULATION"]+1)
+    benefit[1:] = survival_rate()[:-1] * DEATH_PROB * main.get("sum_assured")
+    return np.where(periods <= main.get("remaining_term"), benefit, 0)
 
 
-@variable()
-def net_single_premium(t):
-    if t == settings["T_MAX_CALCULATION"]:
-        return expected_benefit(t)
-    return expected_benefit(t) + net_single_premium(t+1) * 1/(1+INTEREST_RATE)
+@variable(array=True)
+def net_single_premium():
+    discount_rates = np.full(settings["T_MAX_CALCULATION"]+1, 1/(1+INTEREST_RATE))
+    return discount(expected_benefit(), discount_rates)
@@ -1,4 +1,6 @@
-from cashflower import variable
+import numpy as np
+
+from cashflower import discount, variable
 from input import main
 
 from settings import settings
@@ -7,26 +9,22 @@ INTEREST_RATE = 0.005
 DEATH_PROB = 0.003
 
 
-@variable()
-def survival_rate(t):
-    if t == 0:
-        return 1 - DEATH_PROB
-    return survival_rate(t-1) * (1 - DEATH_PROB)
-
+@variable(array=True)
+def survival_rate():
+    return np.cumprod(np.full(settings["T_MAX_CALCULATION"]+1, 1 - DEATH_PROB))
 
-@variable()
-def expected_benefit(t):
-    if t == 0:
-        return 0
 
+@variable(array=True)
+def expected_benefit():
     sum_assured = main.get("sum_assured")
-    if t == settings["T_MAX_CALCULATION"]:
-        return survival_rate(t-1) * sum_assured
-    return survival_rate(t-1) * DEATH_PROB * sum_assured
+    benefit = np.zeros(settings["T_MAX_CALCULATION"]+1)
+    benefit[1:] = survival_rate()[:-1] * DEATH_PROB * sum_assured
+    if settings["T_MAX_CALCULATION"] > 0:
+        benefit[-1] = survival_rate()[-2] * sum_assured
+    return benefit
 
 
-@variable()
-def net_single_premium(t):
-    if t == settings["T_MAX_CALCULATION"]:
-        return expected_benefit(t)
-    return expected_benefit(t) + net_single_premium(t+1) * 1/(1+INTEREST_RATE)
+@variable(array=True)
+def net_single_premium():
+    discount_rates = np.full(settings["T_MAX_CALCULATION"]+1, 1/(1+INTEREST_RATE))
+    return discount(expected_benefit(), discount_rates)